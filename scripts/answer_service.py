@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from context_assembly import assemble_context
+from tracing import span
+
+SEARCH_API_VERSION = '2024-07-01'
+# stream_options (token usage on streamed responses) needs 2024-10-21 or later
+OPENAI_API_VERSION = '2024-10-21'
+SYSTEM_PROMPT = "あなたは社内文書に基づいて回答するアシスタントです。以下の資料だけを根拠に日本語で回答してください。資料に答えがない場合は分からないと答えてください。"
+
+
+def scope_filter(department:str = None, language:str = None, content_type:str = None):
+    """OData filter for a scoped query over the filterable metadata fields, or None when unscoped."""
+    clauses = []
+    if department:
+        clauses.append("department eq '" + department.replace("'", "''") + "'")
+    if language:
+        clauses.append("language eq '" + language.replace("'", "''") + "'")
+    if content_type:
+        clauses.append("content_type eq '" + content_type.replace("'", "''") + "'")
+    return " and ".join(clauses) or None
+
+
+def reciprocal_rank_fusion(result_lists:list, key:str = "chunk_id", k:int = 60):
+    """Fuse ranked result lists the same way hybrid search does on the service side."""
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, document in enumerate(results):
+            scores[document[key]] = scores.get(document[key], 0.0) + 1.0 / (k + rank + 1)
+            documents.setdefault(document[key], document)
+    return [documents[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+class AnswerService:
+    """Async RAG answers over the index created by initial_setup_aisearch.create_index.
+
+    The keyword leg of the hybrid search runs while the query is being embedded, the vector leg starts
+    as soon as the embedding arrives, and chat tokens are streamed as soon as the context is assembled.
+    Each backend gets its own pooled HTTP client and a semaphore bounding in-flight requests.
+    """
+
+    def __init__(self, search_endpoint:str, search_key:str, index_name:str, openai_endpoint:str, openai_key:str,
+                 chat_deployment:str = 'gpt4o', embedding_deployment:str = 'embedding',
+                 max_search_concurrency:int = 16, max_openai_concurrency:int = 8,
+                 top:int = 10, token_budget:int = 3000, timeout:float = 60.0):
+        self.index_name = index_name
+        self.chat_deployment = chat_deployment
+        self.embedding_deployment = embedding_deployment
+        self.top = top
+        self.token_budget = token_budget
+        self._search = httpx.AsyncClient(
+            base_url=search_endpoint.rstrip("/"),
+            headers={'Content-Type': 'application/json', 'api-key': search_key},
+            params={'api-version': SEARCH_API_VERSION},
+            limits=httpx.Limits(max_connections=max_search_concurrency, max_keepalive_connections=max_search_concurrency),
+            timeout=timeout,
+        )
+        self._openai = httpx.AsyncClient(
+            base_url=openai_endpoint.rstrip("/") + "/openai/deployments",
+            headers={'Content-Type': 'application/json', 'api-key': openai_key},
+            params={'api-version': OPENAI_API_VERSION},
+            limits=httpx.Limits(max_connections=max_openai_concurrency, max_keepalive_connections=max_openai_concurrency),
+            timeout=timeout,
+        )
+        self._search_slots = asyncio.Semaphore(max_search_concurrency)
+        self._openai_slots = asyncio.Semaphore(max_openai_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._search.aclose()
+        await self._openai.aclose()
+
+    async def embed(self, query:str):
+        body = {"input": query, "dimensions": 3072}
+        async with self._openai_slots:
+            with span("openai.embeddings", deployment=self.embedding_deployment) as s:
+                r = await self._openai.post(f"/{self.embedding_deployment}/embeddings", json=body)
+                s.set_attribute("status", r.status_code)
+        r.raise_for_status()
+        return r.json()["data"][0]["embedding"]
+
+    async def _search_docs(self, body:dict, leg:str):
+        async with self._search_slots:
+            with span("search.query", index=self.index_name, leg=leg) as s:
+                r = await self._search.post(f"/indexes/{self.index_name}/docs/search", json=body)
+                s.set_attribute("status", r.status_code)
+        r.raise_for_status()
+        return r.json()["value"]
+
+    async def keyword_search(self, query:str, filter:str = None):
+        body = {
+            "search": query,
+            "queryType": "simple",
+            "select": "chunk_id,parent_id,title,chunk,original_chunk,vector",
+            "top": self.top,
+        }
+        if filter:
+            body["filter"] = filter
+        return await self._search_docs(body, "keyword")
+
+    async def vector_search(self, vector:list, filter:str = None):
+        body = {
+            "select": "chunk_id,parent_id,title,chunk,original_chunk,vector",
+            "top": self.top,
+            "vectorQueries": [{"kind": "vector", "vector": vector, "fields": "vector", "k": self.top}],
+            # apply the filter inside the HNSW traversal so scoped queries still get k in-scope neighbours
+            "vectorFilterMode": "preFilter",
+        }
+        if filter:
+            body["filter"] = filter
+        return await self._search_docs(body, "vector")
+
+    async def semantic_search(self, query:str, vector:list, filter:str = None):
+        """Keyword and vector query in one request, reranked by the semantic ranker."""
+        body = {
+            "search": query,
+            "queryType": "semantic",
+            "semanticConfiguration": "semantic-config",
+            "select": "chunk_id,parent_id,title,chunk,original_chunk,vector",
+            "top": self.top,
+            "vectorQueries": [{"kind": "vector", "vector": vector, "fields": "vector", "k": self.top}],
+            "vectorFilterMode": "preFilter",
+        }
+        if filter:
+            body["filter"] = filter
+        return await self._search_docs(body, "semantic")
+
+    async def retrieve(self, query:str, filter:str = None):
+        keyword_task = asyncio.create_task(self.keyword_search(query, filter))
+        try:
+            vector = await self.embed(query)
+            vector_hits = await self.vector_search(vector, filter)
+        except BaseException:
+            keyword_task.cancel()
+            raise
+        keyword_hits = await keyword_task
+        return reciprocal_rank_fusion([keyword_hits, vector_hits])[:self.top]
+
+    async def stream_answer(self, query:str, metrics:dict = None, filter:str = None):
+        """Yield answer text as it arrives. Timings and token usage are written into `metrics` when given."""
+        metrics = metrics if metrics is not None else {}
+        started = time.perf_counter()
+        with span("answer.retrieve"):
+            hits = await self.retrieve(query, filter)
+        assembled = assemble_context(hits, token_budget=self.token_budget)
+        metrics["retrieval_ms"] = (time.perf_counter() - started) * 1000
+        metrics["prompt_tokens_saved"] = assembled["saved_tokens"]
+        metrics["context_tokens_dropped"] = assembled["dropped_tokens"]
+
+        body = {
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT + "\n\n" + assembled["context"]},
+                {"role": "user", "content": query},
+            ],
+            "stream": True,
+            # the last event then carries the real token counts; delta events are not one token each
+            "stream_options": {"include_usage": True},
+        }
+        chunks = 0
+        usage = None
+        first_token_at = None
+        # not a `with` block: the span would stay current across `yield` and leak into the caller's context
+        chat_span = span("openai.chat", deployment=self.chat_deployment).start()
+        error = None
+        try:
+            async with self._openai_slots:
+                async with self._openai.stream("POST", f"/{self.chat_deployment}/chat/completions", json=body) as r:
+                    chat_span.set_attribute("status", r.status_code)
+                    if r.status_code >= 300:
+                        await r.aread()
+                        r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        event = json.loads(data)
+                        usage = event.get("usage") or usage
+                        choices = event.get("choices") or []
+                        content = choices[0].get("delta", {}).get("content") if choices else None
+                        if not content:
+                            continue
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            metrics["time_to_first_token_ms"] = (first_token_at - started) * 1000
+                        chunks += 1
+                        yield content
+        except GeneratorExit:
+            # the caller stopped reading; not an error
+            chat_span.set_attribute("closed_early", True)
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tokens = usage.get("completion_tokens") if usage else None
+            chat_span.set_attributes({"chunks": chunks, "tokens": tokens})
+            chat_span.end(error)
+
+        finished = time.perf_counter()
+        metrics["completion_chunks"] = chunks
+        # None when the deployment does not report usage on streams
+        metrics["completion_tokens"] = tokens
+        metrics["total_ms"] = (finished - started) * 1000
+        generation = finished - first_token_at if first_token_at else 0.0
+        metrics["tokens_per_sec"] = tokens / generation if tokens is not None and generation > 0 else None
+
+    async def answer(self, query:str, filter:str = None):
+        metrics = {}
+        parts = [token async for token in self.stream_answer(query, metrics, filter)]
+        return {"answer": "".join(parts), "metrics": metrics}
+
+
+async def _main(args):
+    async with AnswerService(
+        search_endpoint=os.getenv('AZURE_SEARCH_ENDPOINT'),
+        search_key=os.getenv('AZURE_SEARCH_KEY'),
+        index_name=os.getenv('INDEX_NAME', 'test-index'),
+        openai_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+        openai_key=os.getenv('AZURE_OPENAI_KEY'),
+        chat_deployment=os.getenv('AZURE_OPENAI_CHAT_DEPLOYMENT', 'gpt4o'),
+    ) as service:
+        metrics = {}
+        filter = scope_filter(department=args.department, language=args.language)
+        async for token in service.stream_answer(args.query, metrics, filter):
+            print(token, end="", flush=True)
+        print()
+        print(json.dumps(metrics, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a question with RAG over the search index")
+    parser.add_argument("query")
+    parser.add_argument("--department", help="only search documents under this top-level folder")
+    parser.add_argument("--language", help="only search chunks in this language (e.g. ja)")
+    parser.add_argument("--stub", action="store_true", help="run against a local stub server instead of Azure")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_servers import start_stub_server
+        server, url = start_stub_server(latency=0.02, token_delay=0.01)
+        os.environ.update({'AZURE_SEARCH_ENDPOINT': url, 'AZURE_SEARCH_KEY': 'stub',
+                           'AZURE_OPENAI_ENDPOINT': url, 'AZURE_OPENAI_KEY': 'stub'})
+    else:
+        from load_azd_env import load_azd_env
+        load_azd_env()
+
+    asyncio.run(_main(args))
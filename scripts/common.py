@@ -1,19 +1,55 @@
 import base64
+import mimetypes
+import os
+
+# Keys holding credentials in search resource definitions (skillsets, indexes, indexers)
+SECRET_KEYS = {"apiKey", "key", "storageConnectionString", "connectionString"}
 
 def check_nan(input_value):
     if str(input_value).lower() == "nan":
         return ""
     else:
         return str(input_value)
+
+def normalize_nan(frame):
+    # check_nan for a whole DataFrame batch, done column-wise; unlike check_nan,
+    # missing cells (None / NaN) become "" instead of "None"
+    frame = frame.astype(object).where(frame.notna(), "").astype(str)
+    return frame.mask(frame.apply(lambda column: column.str.lower()) == "nan", "")
     
-def text_to_base64(text):
+def text_to_base64(text, url_safe=False):
     # Convert text to bytes using UTF-8 encoding
     bytes_data = text.encode('utf-8')
 
     # Perform Base64 encoding
-    base64_encoded = base64.b64encode(bytes_data)
+    # (url_safe uses "-" and "_" instead of "+" and "/", which are not allowed in search document keys)
+    if url_safe:
+        base64_encoded = base64.urlsafe_b64encode(bytes_data)
+    else:
+        base64_encoded = base64.b64encode(bytes_data)
 
     # Convert the result back to a UTF-8 string representation
     base64_text = base64_encoded.decode('utf-8')
 
-    return base64_text
\ No newline at end of file
+    return base64_text
+
+def redact(value):
+    # Copy of a resource definition with credentials removed, safe to write to local files
+    if isinstance(value, dict):
+        return {k: (None if k in SECRET_KEYS else redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+def path_facets(path, root=None):
+    # department / content_type for a local file, matching what the indexer gets for the synced blob:
+    # the top-level folder under `root` (data/docs is synced to the container root) and the MIME type.
+    # Files directly under `root` or outside it have no department, like blobs at the container root.
+    path = os.path.abspath(path)
+    department = None
+    if root and os.path.commonpath([path, os.path.abspath(root)]) == os.path.abspath(root):
+        parts = os.path.relpath(path, root).split(os.sep)
+        if len(parts) > 1:
+            department = parts[0]
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return department, content_type
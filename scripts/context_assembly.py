@@ -0,0 +1,293 @@
+import re
+
+import numpy as np
+
+# The SplitSkill settings in initial_setup_aisearch.py produce pages of up to 2000 characters
+# with a 500 character overlap, so adjacent hits of one document repeat a lot of text.
+MIN_OVERLAP = 20
+# a segment is only trimmed into the remaining budget when at least this much room is left
+MIN_TRIM_TOKENS = 50
+PAGE_ORDINAL = re.compile(r"_pages_(\d+)$")
+# between adjacent pages whose overlap could not be found, so their text is not run together
+PAGE_SEPARATOR = "\n"
+SENTENCE_ENDS = "。．.!?！？\n"
+
+
+def estimate_tokens(text:str):
+    """Rough cl100k-style estimate: about one token per Japanese character, four ASCII characters per token."""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def page_ordinal(chunk_id:str):
+    """Position of a chunk inside its parent, from the `..._pages_<n>` suffix of index projection keys."""
+    match = PAGE_ORDINAL.search(chunk_id or "")
+    return int(match.group(1)) if match else None
+
+
+def overlap_length(left:str, right:str, min_overlap:int = MIN_OVERLAP):
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    pos = left.find(probe, max(0, len(left) - len(right)))
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(probe, pos + 1)
+    return 0
+
+
+def translated_overlap(previous:dict, hit:dict, text_field:str = "chunk"):
+    """Characters to drop from the start of `hit[text_field]` when its text is a translation of `original_chunk`.
+
+    A translated chunk does not repeat the SplitSkill overlap word for word, so the overlap is found on
+    original_chunk and the same share of the translation is dropped, backed off to a sentence end
+    so that new text is never lost (a sentence of duplicate text may remain).
+    """
+    text = hit.get(text_field) or ""
+    original, previous_original = hit.get("original_chunk"), previous.get("original_chunk")
+    if text_field == "original_chunk" or not original or not previous_original or original == text:
+        return 0
+    overlap = overlap_length(previous_original, original)
+    if not overlap:
+        return 0
+    cut = len(text) * overlap // len(original)
+    boundary = max(text.rfind(c, 0, cut) for c in SENTENCE_ENDS)
+    return boundary + 1 if boundary >= 0 else 0
+
+
+def merge_hits(hits:list, text_field:str = "chunk"):
+    """Group hits by parent_id and stitch adjacent chunks into contiguous segments.
+
+    Each segment keeps the hits it was built from, its text, its best retrieval rank, its source position
+    and the (rank, start, end) character span of every hit inside the text. Text dropped from translated
+    chunks as overlap is kept in `cuts` by rank, since it has no span.
+    """
+    by_parent = {}
+    for rank, hit in enumerate(hits):
+        by_parent.setdefault(hit.get("parent_id"), []).append((rank, hit))
+
+    segments = []
+    for parent_id, parent_hits in by_parent.items():
+        # order by page ordinal when the key carries one, otherwise keep retrieval order
+        parent_hits.sort(key=lambda item: (page_ordinal(item[1].get("chunk_id")) is None,
+                                           page_ordinal(item[1].get("chunk_id")) or 0, item[0]))
+        current = None
+        for rank, hit in parent_hits:
+            text = hit.get(text_field) or ""
+            ordinal = page_ordinal(hit.get("chunk_id"))
+            if current is not None:
+                if text in current["text"]:
+                    start = current["text"].find(text)
+                    current["hits"].append(hit)
+                    current["spans"].append((rank, start, start + len(text)))
+                    current["best_rank"] = min(current["best_rank"], rank)
+                    current["overlap_chars"] += len(text)
+                    continue
+                overlap = overlap_length(current["text"], text)
+                adjacent = ordinal is not None and current["last_ordinal"] is not None and ordinal == current["last_ordinal"] + 1
+                if overlap or adjacent:
+                    if overlap:
+                        start = len(current["text"]) - overlap
+                        current["text"] += text[overlap:]
+                    else:
+                        cut = translated_overlap(current["last_hit"], hit, text_field)
+                        if cut:
+                            current["cuts"][rank] = text[:cut]
+                        current["text"] += PAGE_SEPARATOR
+                        start = len(current["text"])
+                        current["text"] += text[cut:]
+                        overlap = cut
+                    current["hits"].append(hit)
+                    current["spans"].append((rank, start, len(current["text"])))
+                    current["best_rank"] = min(current["best_rank"], rank)
+                    current["overlap_chars"] += overlap
+                    current["last_ordinal"] = ordinal
+                    current["last_hit"] = hit
+                    continue
+            current = {
+                "parent_id": parent_id,
+                "title": hit.get("title"),
+                "text": text,
+                "hits": [hit],
+                "spans": [(rank, 0, len(text))],
+                "best_rank": rank,
+                "position": ordinal,
+                "last_ordinal": ordinal,
+                "last_hit": hit,
+                "overlap_chars": 0,
+                "cuts": {},
+            }
+            segments.append(current)
+    return segments
+
+
+def _segment_vector(segment:dict):
+    vectors = [hit["vector"] for hit in segment["hits"] if hit.get("vector")]
+    if not vectors:
+        return None
+    vector = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def _widest_end(text:str, start:int, end:int, limit:int, token_budget:int, count_tokens):
+    """Largest end in [end, limit] with text[start:end] within `token_budget`."""
+    low, high = end, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[start:middle]) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _widest_start(text:str, start:int, end:int, limit:int, token_budget:int, count_tokens):
+    """Smallest start in [limit, start] with text[start:end] within `token_budget`."""
+    low, high = limit, start
+    while low < high:
+        middle = (low + high) // 2
+        if count_tokens(text[middle:end]) <= token_budget:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def trim_segment(segment:dict, token_budget:int, count_tokens=estimate_tokens):
+    """Cut a segment down to `token_budget`, keeping the text of its best ranked hits. None if nothing fits.
+
+    Starts from the best hit (shortened from the end if it alone is too long), widens the window
+    to cover further hits in rank order while they fit whole, then fills what is left of the budget
+    with the part of the next ranked hit that is adjacent to the window.
+    """
+    spans = sorted(zip(segment["spans"], segment["hits"]), key=lambda item: item[0][0])
+    text = segment["text"]
+    _, start, end = spans[0][0]
+    if count_tokens(text[start:end]) > token_budget:
+        end = _widest_end(text, start, start, end, token_budget, count_tokens)
+    else:
+        for (_, span_start, span_end), _ in spans[1:]:
+            wider_start, wider_end = min(start, span_start), max(end, span_end)
+            if count_tokens(text[wider_start:wider_end]) <= token_budget:
+                start, end = wider_start, wider_end
+        partial = next(((span_start, span_end) for (_, span_start, span_end), _ in spans[1:]
+                        if span_start < start or span_end > end), None)
+        if partial is not None:
+            span_start, span_end = partial
+            if span_end > end:
+                end = _widest_end(text, start, end, span_end, token_budget, count_tokens)
+            else:
+                start = _widest_start(text, start, end, span_start, token_budget, count_tokens)
+
+    kept = [(span, hit) for span, hit in zip(segment["spans"], segment["hits"]) if span[1] < end and span[2] > start]
+    if not kept:
+        return None
+    ordinals = [page_ordinal(hit.get("chunk_id")) for _, hit in kept]
+    return dict(
+        segment,
+        text=text[start:end],
+        hits=[hit for _, hit in kept],
+        spans=[(rank, max(span_start, start) - start, min(span_end, end) - start) for (rank, span_start, span_end), _ in kept],
+        best_rank=min(rank for (rank, _, _), _ in kept),
+        position=min((ordinal for ordinal in ordinals if ordinal is not None), default=segment["position"]),
+        trimmed=True,
+    )
+
+
+def overlap_tokens(segment:dict, count_tokens=estimate_tokens):
+    """Tokens de-duplication saved inside a segment: its hits (as far as they are kept) sent one by one, minus the stitched text."""
+    text = segment["text"]
+    # a cut only saved something when the text it duplicated precedes the hit in the segment
+    cut_tokens = sum(count_tokens(segment["cuts"][rank]) for rank, start, _ in segment["spans"] if rank in segment["cuts"] and start > 0)
+    return sum(count_tokens(text[start:end]) for _, start, end in segment["spans"]) + cut_tokens - count_tokens(text)
+
+
+def select_mmr(segments:list, token_budget:int, count_tokens=estimate_tokens, diversity:float = 0.3):
+    """Greedy MMR selection of segments within `token_budget`.
+
+    Relevance comes from retrieval rank, redundancy from cosine similarity of the stored chunk vectors.
+    A chosen segment that does not fit is trimmed to the remaining budget around its best hits,
+    so stitching adjacent chunks never pushes the most relevant evidence out of the prompt.
+    """
+    if not segments:
+        return []
+    segments = list(segments)
+    ranks = max(segment["best_rank"] for segment in segments) + 1
+    relevance = [1.0 - segment["best_rank"] / ranks for segment in segments]
+    vectors = [_segment_vector(segment) for segment in segments]
+    tokens = [count_tokens(segment["text"]) for segment in segments]
+
+    selected = []
+    remaining = set(range(len(segments)))
+    used = 0
+    while remaining:
+        best, best_score = None, None
+        for i in remaining:
+            if used + tokens[i] > token_budget and token_budget - used < MIN_TRIM_TOKENS:
+                continue
+            redundancy = 0.0
+            if vectors[i] is not None:
+                for j in selected:
+                    if vectors[j] is not None:
+                        redundancy = max(redundancy, float(vectors[i] @ vectors[j]))
+            score = (1 - diversity) * relevance[i] - diversity * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        if used + tokens[best] > token_budget:
+            trimmed = trim_segment(segments[best], token_budget - used, count_tokens)
+            if trimmed is None:
+                remaining.discard(best)
+                continue
+            segments[best] = trimmed
+            tokens[best] = count_tokens(trimmed["text"])
+        selected.append(best)
+        remaining.discard(best)
+        used += tokens[best]
+    return [segments[i] for i in selected]
+
+
+def assemble_context(hits:list, token_budget:int = 3000, count_tokens=estimate_tokens, diversity:float = 0.3, text_field:str = "chunk"):
+    """Build the prompt context for `hits` (search results in rank order) within `token_budget`.
+
+    Returns a dict with the context text, the selected segments and token accounting:
+    raw_tokens is what concatenating every hit would cost, saved_tokens (= overlap_tokens_removed) what
+    de-duplicating overlapping chunks saved in the prompt (selected segments only, after trimming),
+    and dropped_tokens the de-duplicated text left out by the budget.
+    """
+    raw_tokens = sum(count_tokens(hit.get(text_field) or "") for hit in hits)
+    segments = merge_hits(hits, text_field=text_field)
+    merged_tokens = sum(count_tokens(segment["text"]) for segment in segments)
+    selected = select_mmr(segments, token_budget, count_tokens=count_tokens, diversity=diversity)
+
+    # documents in order of their best selected hit, segments in source order within a document
+    parent_rank = {}
+    for segment in selected:
+        parent_rank[segment["parent_id"]] = min(parent_rank.get(segment["parent_id"], segment["best_rank"]), segment["best_rank"])
+    selected.sort(key=lambda s: (parent_rank[s["parent_id"]], s["position"] is None, s["position"] or 0, s["best_rank"]))
+
+    parts = []
+    previous_parent = object()
+    for segment in selected:
+        if segment["parent_id"] != previous_parent:
+            parts.append(f"[{segment['title'] or segment['parent_id']}]\n{segment['text']}")
+            previous_parent = segment["parent_id"]
+        else:
+            parts.append(segment["text"])
+    context = "\n\n".join(parts)
+    prompt_tokens = count_tokens(context)
+    overlap_tokens_removed = sum(overlap_tokens(segment, count_tokens) for segment in selected)
+
+    return {
+        "context": context,
+        "segments": selected,
+        "raw_tokens": raw_tokens,
+        "overlap_tokens_removed": overlap_tokens_removed,
+        "dropped_tokens": merged_tokens - sum(count_tokens(segment["text"]) for segment in selected),
+        "prompt_tokens": prompt_tokens,
+        "saved_tokens": overlap_tokens_removed,
+    }
@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import requests
+
+from common import redact
+from initial_setup_aisearch import PREVIEW_API_VERSION, build_skillset_payload
+from load_azd_env import load_azd_env
+from tracing import span
+
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".enrichment_cache")
+
+
+def _input_paths(skill:dict):
+    """Enrichment tree paths read by a skill, including paths referenced in `= $(...)` expressions."""
+    paths = []
+    for skill_input in skill.get("inputs", []):
+        source = skill_input.get("source")
+        if source is None:
+            paths.extend(_input_paths(skill_input))
+        elif source.startswith("="):
+            paths.extend(re.findall(r"\$\(([^)]+)\)", source))
+        else:
+            paths.append(source)
+    return paths
+
+
+def _output_paths(skill:dict):
+    context = skill.get("context", "/document")
+    return [context.rstrip("/") + "/" + output["targetName"] for output in skill.get("outputs", [])]
+
+
+def _reads(path:str, produced:str):
+    return path == produced or path.startswith(produced + "/")
+
+
+def skill_dependencies(skills:list):
+    """Map each skill name to the names of skills that consume its outputs."""
+    downstream = {skill["name"]: set() for skill in skills}
+    for producer in skills:
+        produced = _output_paths(producer)
+        for consumer in skills:
+            if consumer is producer:
+                continue
+            if any(_reads(path, out) for path in _input_paths(consumer) for out in produced):
+                downstream[producer["name"]].add(consumer["name"])
+    return downstream
+
+
+def invalidated_skills(previous:dict, current:dict):
+    """Skills whose definition changed in `current`, plus every skill downstream of them.
+
+    Returns None when there is no previous definition, meaning everything must run.
+    """
+    if previous is None:
+        return None
+    old_skills = {skill["name"]: redact(skill) for skill in previous.get("skills", [])}
+    new_skills = {skill["name"]: redact(skill) for skill in current.get("skills", [])}
+    changed = {name for name, skill in new_skills.items() if old_skills.get(name) != skill}
+
+    # a removed skill invalidates whatever used to read its outputs
+    downstream = skill_dependencies(current.get("skills", []))
+    removed = [skill for name, skill in old_skills.items() if name not in new_skills]
+    for skill in removed:
+        produced = _output_paths(skill)
+        for consumer in current.get("skills", []):
+            if any(_reads(path, out) for path in _input_paths(consumer) for out in produced):
+                changed.add(consumer["name"])
+
+    invalidated = set()
+    pending = list(changed)
+    while pending:
+        name = pending.pop()
+        if name in invalidated:
+            continue
+        invalidated.add(name)
+        pending.extend(downstream.get(name, ()))
+    # keep the skillset order so the plan reads like the pipeline
+    return [skill["name"] for skill in current.get("skills", []) if skill["name"] in invalidated]
+
+
+def _state_path(skillset_name:str):
+    return os.path.join(STATE_DIR, skillset_name + ".json")
+
+
+def fingerprint(skillset_payload:dict):
+    """Hash of the full payload, credentials included, so a rotated key also counts as a change."""
+    return hashlib.sha256(json.dumps(skillset_payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_applied_skillset(skillset_name:str):
+    """Return (redacted skillset, fingerprint) of the last applied definition, or (None, None)."""
+    path = _state_path(skillset_name)
+    if not os.path.exists(path):
+        return None, None
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    return state["skillset"], state["fingerprint"]
+
+
+def save_applied_skillset(skillset_payload:dict):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(_state_path(skillset_payload["name"]), "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint(skillset_payload), "skillset": redact(skillset_payload)}, f, ensure_ascii=False, indent=2)
+
+
+def reset_skills(skillset_name:str, skill_names:list, ai_search_endpoint:str, ai_search_key:str):
+    headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
+    params = {'api-version': PREVIEW_API_VERSION}
+    body = json.dumps({"skillNames": skill_names})
+    with span("search.post", resource_type="skillsets", resource_name=skillset_name, payload_bytes=len(body), skills=len(skill_names)) as s:
+        r = requests.post(ai_search_endpoint + "/skillsets/" + skillset_name + "/resetskills",
+                          data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
+    print("status code: ", r.status_code)
+    return 200 <= r.status_code < 300
+
+
+def run_indexer(indexer_name:str, ai_search_endpoint:str, ai_search_key:str):
+    headers = {'api-key': ai_search_key}
+    params = {'api-version': '2024-07-01'}
+    with span("search.post", resource_type="indexers", resource_name=indexer_name) as s:
+        r = requests.post(ai_search_endpoint + "/indexers/" + indexer_name + "/run",
+                          headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
+    print("status code: ", r.status_code)
+    return 200 <= r.status_code < 300
+
+
+def apply_skillset(skillset_payload:dict, indexer_name:str, ai_search_endpoint:str, ai_search_key:str, dry_run:bool = False, reset_all:bool = False):
+    """Update the skillset and re-run only the skills invalidated since the last applied definition.
+
+    Without a saved definition nothing is known about what changed, so only new or modified documents
+    are enriched on the next run unless `reset_all` resets every skill.
+    """
+    skillset_name = skillset_payload["name"]
+    previous, previous_fingerprint = load_applied_skillset(skillset_name)
+    # any change to the payload (projections, cognitiveServices, keys...) has to be PUT;
+    # the skill-level diff only decides which skills to reset
+    if not reset_all and previous_fingerprint == fingerprint(skillset_payload):
+        print("Skillset unchanged. Nothing to re-run.")
+        return
+    invalidated = invalidated_skills(previous, skillset_payload)
+    if reset_all:
+        invalidated = [skill["name"] for skill in skillset_payload["skills"]]
+        print("Resetting all skills. Every document will be enriched again.")
+    elif invalidated is None:
+        invalidated = []
+        print("No previously applied skillset found. The skillset will be applied and saved as the baseline;")
+        print("the indexer run only enriches new or changed documents. Use --reset-all to re-enrich everything.")
+    elif not invalidated:
+        print("Skillset settings changed but no skill did. The skillset will be updated without re-running skills.")
+    else:
+        print("Skills to re-run:")
+        for name in invalidated:
+            print("  ", name)
+    if dry_run:
+        return
+
+    headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
+    params = {'api-version': '2024-07-01'}
+    body = json.dumps(skillset_payload)
+    with span("search.put", resource_type="skillsets", resource_name=skillset_name, payload_bytes=len(body)) as s:
+        r = requests.put(ai_search_endpoint + "/skillsets/" + skillset_name,
+                         data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
+    print("status code: ", r.status_code)
+    if not 200 <= r.status_code < 300:
+        print("Error updating skillset")
+        return
+
+    # with the indexer cache enabled, resetting the invalidated skills makes the next run
+    # recompute only those skills and reuse cached outputs for everything else
+    if invalidated and not reset_skills(skillset_name, invalidated, ai_search_endpoint, ai_search_key):
+        print("Error resetting skills")
+        return
+    if run_indexer(indexer_name, ai_search_endpoint, ai_search_key):
+        save_applied_skillset(skillset_payload)
+        print("Indexer run started")
+    else:
+        print("Error running indexer")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply skillset changes and re-run only the affected skills")
+    parser.add_argument("--dry-run", action="store_true", help="only print the skills that would be re-run")
+    parser.add_argument("--reset-all", action="store_true", help="reset every skill so all documents are enriched again")
+    args = parser.parse_args()
+
+    load_azd_env()
+
+    with span("enrichment_cache.apply", profile=True):
+        apply_skillset(
+            build_skillset_payload(
+                skillset_name=os.getenv('SKILL_SET_NAME', 'test-skillset'),
+                index_name=os.getenv('INDEX_NAME', 'test-index'),
+                azure_openai_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+                azure_openai_key=os.getenv('AZURE_OPENAI_KEY'),
+                text_embedding_model=os.getenv('AZURE_OPENAI_EMBEDDING_MODEL'),
+                aiservices_key=os.getenv('AZURE_AISERVICES_KEY')
+            ),
+            indexer_name=os.getenv('INDEXER_NAME', 'test-indexer'),
+            ai_search_endpoint=os.getenv('AZURE_SEARCH_ENDPOINT'),
+            ai_search_key=os.getenv('AZURE_SEARCH_KEY'),
+            dry_run=args.dry_run,
+            reset_all=args.reset_all
+        )
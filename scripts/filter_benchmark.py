@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import time
+
+import requests
+from openai import AzureOpenAI
+
+from answer_service import scope_filter
+from load_test import load_queries, percentile
+from tracing import span
+
+# Compares scoped vector queries three ways against an exhaustive in-scope KNN as ground truth:
+#   prefilter  : filter applied inside the HNSW search (vectorFilterMode=preFilter)
+#   postfilter : filter applied by the service to the top-k vector results (vectorFilterMode=postFilter)
+#   client     : unfiltered top-k, filtered on the client (what scoped queries did before the fields were filterable)
+
+API_VERSION = '2024-07-01'
+STRATEGIES = ("prefilter", "postfilter", "client")
+SCOPE_FIELDS = ("department", "language", "content_type")
+
+
+def search(session:requests.Session, body:dict, index_name:str, ai_search_endpoint:str, ai_search_key:str):
+    headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
+    params = {'api-version': API_VERSION}
+    r = session.post(ai_search_endpoint + "/indexes/" + index_name + "/docs/search",
+                     data=json.dumps(body), headers=headers, params=params)
+    r.raise_for_status()
+    return r.json()
+
+
+def discover_scopes(session:requests.Session, index_name:str, ai_search_endpoint:str, ai_search_key:str, field:str = "department", limit:int = 5):
+    """The most common values of a facetable field, used as scopes when none are given."""
+    body = {"search": "*", "top": 0, "facets": [f"{field},count:{limit}"]}
+    result = search(session, body, index_name, ai_search_endpoint, ai_search_key)
+    return [{field: facet["value"]} for facet in result.get("@search.facets", {}).get(field, [])]
+
+
+def _in_scope(document:dict, scope:dict):
+    for field, value in scope.items():
+        if document.get(field) != value:
+            return False
+    return True
+
+
+def embed_queries(client:AzureOpenAI, queries:list, deployment:str = 'embedding', batch_size:int = 100):
+    """Embed every query once up front, the way answer_service does, so timings compare the filter strategies only."""
+    vectors = []
+    for i in range(0, len(queries), batch_size):
+        with span("benchmark.embed", queries=len(queries[i:i + batch_size])):
+            response = client.embeddings.create(input=queries[i:i + batch_size], model=deployment, dimensions=3072)
+        vectors.extend(item.embedding for item in response.data)
+    return vectors
+
+
+def scoped_query(session:requests.Session, strategy:str, vector:list, scope:dict, k:int,
+                 index_name:str, ai_search_endpoint:str, ai_search_key:str, exhaustive:bool = False):
+    """Run one scoped vector query and return (chunk_ids, latency_ms)."""
+    vector_query = {"kind": "vector", "vector": vector, "fields": "vector", "k": k}
+    if exhaustive:
+        vector_query["exhaustive"] = True
+    body = {"select": "chunk_id," + ",".join(SCOPE_FIELDS), "top": k, "vectorQueries": [vector_query]}
+    if strategy != "client":
+        body["filter"] = scope_filter(**scope)
+        body["vectorFilterMode"] = "preFilter" if strategy == "prefilter" else "postFilter"
+
+    started = time.perf_counter()
+    with span("benchmark.query", strategy=strategy, exhaustive=exhaustive, **scope):
+        documents = search(session, body, index_name, ai_search_endpoint, ai_search_key)["value"]
+    latency_ms = (time.perf_counter() - started) * 1000
+    if strategy == "client":
+        documents = [document for document in documents if _in_scope(document, scope)]
+    return [document["chunk_id"] for document in documents], latency_ms
+
+
+def run_benchmark(queries:list, scopes:list, index_name:str, ai_search_endpoint:str, ai_search_key:str, openai_client:AzureOpenAI,
+                  k:int = 10, repeat:int = 1):
+    results = {strategy: {"latencies": [], "recall": [], "returned": []} for strategy in STRATEGIES}
+    with requests.Session() as session:
+        if not scopes:
+            scopes = discover_scopes(session, index_name, ai_search_endpoint, ai_search_key)
+        vectors = embed_queries(openai_client, queries) if scopes else []
+        for scope in scopes:
+            for vector in vectors:
+                truth, _ = scoped_query(session, "prefilter", vector, scope, k, index_name, ai_search_endpoint, ai_search_key, exhaustive=True)
+                for _ in range(repeat):
+                    for strategy in STRATEGIES:
+                        found, latency_ms = scoped_query(session, strategy, vector, scope, k, index_name, ai_search_endpoint, ai_search_key)
+                        results[strategy]["latencies"].append(latency_ms)
+                        results[strategy]["returned"].append(len(found))
+                        if truth:
+                            results[strategy]["recall"].append(len(set(found) & set(truth)) / len(truth))
+
+    report = []
+    for strategy in STRATEGIES:
+        latencies = sorted(results[strategy]["latencies"])
+        recall = results[strategy]["recall"]
+        returned = results[strategy]["returned"]
+        report.append({
+            "strategy": strategy,
+            "queries": len(latencies),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "recall_at_k": sum(recall) / len(recall) if recall else None,
+            "mean_hits": sum(returned) / len(returned) if returned else 0.0,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pre-filtered vs post-filtered scoped vector queries")
+    parser.add_argument("--queries", help="query log (text or JSON lines); synthetic Japanese queries when omitted")
+    parser.add_argument("--department", action="append", help="scope to this department (repeatable); top facets when omitted")
+    parser.add_argument("--language", help="additionally scope every query to this language")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per query and strategy")
+    args = parser.parse_args()
+
+    from load_azd_env import load_azd_env
+    load_azd_env()
+
+    scopes = [{"department": department} for department in (args.department or [])]
+    if args.language:
+        scopes = [dict(scope, language=args.language) for scope in scopes] or [{"language": args.language}]
+
+    report = run_benchmark(
+        queries=load_queries(args.queries),
+        scopes=scopes,
+        index_name=os.getenv('INDEX_NAME', 'test-index'),
+        ai_search_endpoint=os.getenv('AZURE_SEARCH_ENDPOINT'),
+        ai_search_key=os.getenv('AZURE_SEARCH_KEY'),
+        openai_client=AzureOpenAI(
+            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+            api_key=os.getenv('AZURE_OPENAI_KEY'),
+            api_version='2024-06-01'
+        ),
+        k=args.k,
+        repeat=args.repeat
+    )
+    if not any(row["queries"] for row in report):
+        print("No scopes to benchmark. Pass --department/--language or index documents under department folders.")
+    for row in report:
+        recall = "-" if row["recall_at_k"] is None else f"{row['recall_at_k']:.3f}"
+        latency = "/".join("-" if row[key] is None else f"{row[key]:.0f}" for key in ("p50_ms", "p95_ms"))
+        print(f"{row['strategy']:<10} p50/p95 {latency} ms  recall@{args.k} {recall}  hits {row['mean_hits']:.1f}")
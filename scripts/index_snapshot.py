@@ -0,0 +1,240 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from common import redact
+from initial_setup_aisearch import create_index
+from load_azd_env import load_azd_env
+from tracing import span
+
+# Snapshot layout (one directory per snapshot):
+#   manifest.json           index schema (secrets removed), document count, column list, vector shapes
+#   columns/<field>.jsonl.gz one JSON value per line per document, in chunk_id order
+#   vectors/<field>.f32|f16  contiguous little-endian array of shape (count, dimensions)
+# Restoring copies these into any index that has the same key field, so a schema change
+# becomes an upload instead of re-running OCR, translation, entities and embeddings.
+
+API_VERSION = '2024-07-01'
+VECTOR_TYPE = "Collection(Edm.Single)"
+RETRY_STATUS = (429, 503)
+# significant digits that are always enough to read a value back in each stored precision
+VECTOR_DIGITS = {"float16": 5, "float32": 9}
+
+
+def get_index(index_name:str, ai_search_endpoint:str, ai_search_key:str):
+    headers = {'api-key': ai_search_key}
+    params = {'api-version': API_VERSION}
+    r = requests.get(ai_search_endpoint + "/indexes/" + index_name, headers=headers, params=params)
+    r.raise_for_status()
+    return r.json()
+
+
+def iter_documents(index_name:str, key_field:str, select:list, ai_search_endpoint:str, ai_search_key:str, page_size:int = 1000):
+    """Page through every document ordered by key. Filtering on the last key avoids the $skip limit."""
+    headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
+    params = {'api-version': API_VERSION}
+    last_key = None
+    with requests.Session() as session:
+        while True:
+            body = {"search": "*", "select": ",".join(select), "orderby": key_field + " asc", "top": page_size}
+            if last_key is not None:
+                body["filter"] = f"{key_field} gt '" + last_key.replace("'", "''") + "'"
+            with span("snapshot.page", index=index_name) as s:
+                r = session.post(ai_search_endpoint + "/indexes/" + index_name + "/docs/search",
+                                 data=json.dumps(body), headers=headers, params=params)
+                s.set_attribute("status", r.status_code)
+            r.raise_for_status()
+            page = r.json()["value"]
+            yield from page
+            if len(page) < page_size:
+                return
+            last_key = page[-1][key_field]
+
+
+def export_snapshot(index_name:str, snapshot_dir:str, ai_search_endpoint:str, ai_search_key:str, vector_dtype:str = "float32", page_size:int = 1000):
+    print(f"Exporting {index_name} to {snapshot_dir}")
+    dtype = np.dtype(vector_dtype).newbyteorder("<")
+    schema = get_index(index_name, ai_search_endpoint, ai_search_key)
+    fields = [field for field in schema["fields"] if field.get("retrievable", True)]
+    # vectors of a non-retrievable field cannot be read back, so a restore from this snapshot has to re-embed them
+    skipped_vectors = [field["name"] for field in schema["fields"] if field["type"] == VECTOR_TYPE and field not in fields]
+    if skipped_vectors:
+        print("Warning: vector fields are not retrievable and will not be exported:", ", ".join(skipped_vectors))
+    key_field = next(field["name"] for field in schema["fields"] if field.get("key"))
+    vector_fields = [field["name"] for field in fields if field["type"] == VECTOR_TYPE]
+    columns = [field["name"] for field in fields if field["type"] != VECTOR_TYPE]
+    # a document can lack a vector (e.g. an empty chunk), so presence is stored as its own column
+    presence_columns = {name: "__has_" + name for name in vector_fields}
+
+    os.makedirs(os.path.join(snapshot_dir, "columns"), exist_ok=True)
+    os.makedirs(os.path.join(snapshot_dir, "vectors"), exist_ok=True)
+    column_files = {name: gzip.open(os.path.join(snapshot_dir, "columns", name + ".jsonl.gz"), "wt", encoding="utf-8")
+                    for name in columns + list(presence_columns.values())}
+    vector_files = {name: open(os.path.join(snapshot_dir, "vectors", name + "." + dtype.name.replace("float", "f")), "wb")
+                    for name in vector_fields}
+    dimensions = {name: next((field.get("dimensions") for field in fields if field["name"] == name), None) for name in vector_fields}
+
+    count = 0
+    try:
+        with span("snapshot.export", profile=True, index=index_name) as s:
+            for document in iter_documents(index_name, key_field, columns + vector_fields, ai_search_endpoint, ai_search_key, page_size):
+                for name in columns:
+                    column_files[name].write(json.dumps(document.get(name), ensure_ascii=False) + "\n")
+                for name in vector_fields:
+                    vector = document.get(name)
+                    column_files[presence_columns[name]].write("true\n" if vector else "false\n")
+                    if not vector:
+                        vector = [0.0] * dimensions[name]
+                    vector_files[name].write(np.asarray(vector, dtype=dtype).tobytes())
+                count += 1
+            s.set_attribute("documents", count)
+    finally:
+        for f in list(column_files.values()) + list(vector_files.values()):
+            f.close()
+
+    manifest = {
+        "index": redact(schema),
+        "key_field": key_field,
+        "count": count,
+        "columns": columns,
+        "vectors": {name: {"file": os.path.basename(vector_files[name].name), "dtype": dtype.name,
+                           "dimensions": dimensions[name], "presence_column": presence_columns[name]}
+                    for name in vector_fields},
+        "skipped_vectors": skipped_vectors,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(snapshot_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Exported {count} documents")
+    return count
+
+
+def shortest_floats(values:np.ndarray):
+    """Python floats that json.dumps writes with the fewest digits that still read back as `values`.
+
+    A float32 converted as is serializes with all its float64 digits (0.1 -> 0.10000000149011612).
+    Each element is rounded to 1, 2, ... significant digits, vectorized over the whole array,
+    and keeps the first rounding that converts back to the same value in the stored dtype.
+    """
+    exact = values.astype(np.float64)
+    result = exact.copy()
+    pending = np.isfinite(exact) & (exact != 0)
+    magnitude = np.floor(np.log10(np.abs(exact, out=np.ones_like(exact), where=pending)))
+    for digits in range(1, VECTOR_DIGITS[values.dtype.name] + 1):
+        scale = 10.0 ** (digits - 1 - magnitude)
+        candidate = np.rint(exact * scale) / scale
+        found = pending & (candidate.astype(values.dtype) == values)
+        result[found] = candidate[found]
+        pending &= ~found
+        if not pending.any():
+            break
+    # anything left keeps its exact value
+    return result.tolist()
+
+
+def iter_snapshot(snapshot_dir:str, fields:set = None):
+    """Yield documents from a snapshot, reading only `fields` (all when None)."""
+    with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    columns = [name for name in manifest["columns"] if fields is None or name in fields or name == manifest["key_field"]]
+    vectors = {name: spec for name, spec in manifest["vectors"].items() if fields is None or name in fields}
+    readers = {name: gzip.open(os.path.join(snapshot_dir, "columns", name + ".jsonl.gz"), "rt", encoding="utf-8")
+               for name in columns + [spec["presence_column"] for spec in vectors.values()]}
+    arrays = {name: np.memmap(os.path.join(snapshot_dir, "vectors", spec["file"]), dtype=np.dtype(spec["dtype"]).newbyteorder("<"),
+                              mode="r", shape=(manifest["count"], spec["dimensions"]))
+              for name, spec in vectors.items() if manifest["count"]}
+    try:
+        for row in range(manifest["count"]):
+            document = {name: json.loads(readers[name].readline()) for name in columns}
+            for name, spec in vectors.items():
+                if json.loads(readers[spec["presence_column"]].readline()):
+                    document[name] = shortest_floats(arrays[name][row])
+            yield document
+    finally:
+        for reader in readers.values():
+            reader.close()
+
+
+def upload_batch(session:requests.Session, documents:list, index_name:str, ai_search_endpoint:str, ai_search_key:str, max_retries:int = 5):
+    headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
+    params = {'api-version': API_VERSION}
+    body = json.dumps({"value": [{"@search.action": "upload", **document} for document in documents]})
+    with span("search.post", resource_type="docs", resource_name=index_name, payload_bytes=len(body), documents=len(documents)) as s:
+        for retries in range(max_retries + 1):
+            r = session.post(ai_search_endpoint + "/indexes/" + index_name + "/docs/index", data=body, headers=headers, params=params)
+            if r.status_code not in RETRY_STATUS or retries == max_retries:
+                break
+            time.sleep(min(30, 2 ** retries))
+        s.set_attributes({"status": r.status_code, "retries": retries})
+    if not 200 <= r.status_code < 300:
+        print("Error uploading documents. status code: ", r.status_code)
+        return 0
+    return sum(1 for result in r.json()["value"] if result.get("status"))
+
+
+def restore_snapshot(snapshot_dir:str, index_name:str, ai_search_endpoint:str, ai_search_key:str, batch_size:int = 100, workers:int = 8):
+    """Upload a snapshot into an existing `index_name`. Fields missing from the target index are dropped."""
+    print(f"Restoring {snapshot_dir} into {index_name}")
+    target_fields = {field["name"] for field in get_index(index_name, ai_search_endpoint, ai_search_key)["fields"]}
+    with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+        missing = [name for name in json.load(f).get("skipped_vectors", []) if name in target_fields]
+    if missing:
+        print("Warning: the snapshot has no data for these vector fields, they will be empty:", ", ".join(missing))
+    uploaded = 0
+    pending = set()
+    with span("snapshot.restore", profile=True, index=index_name) as s, \
+            requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        session.mount("https://", HTTPAdapter(pool_connections=workers, pool_maxsize=workers))
+        batch = []
+        for document in iter_snapshot(snapshot_dir, target_fields):
+            batch.append(document)
+            if len(batch) < batch_size:
+                continue
+            # keep at most two batches per worker in memory
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                uploaded += sum(future.result() for future in done)
+            pending.add(executor.submit(upload_batch, session, batch, index_name, ai_search_endpoint, ai_search_key))
+            batch = []
+        if batch:
+            pending.add(executor.submit(upload_batch, session, batch, index_name, ai_search_endpoint, ai_search_key))
+        uploaded += sum(future.result() for future in pending)
+        s.set_attribute("documents", uploaded)
+    print(f"Restored {uploaded} documents")
+    return uploaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export an index to a local snapshot or restore a snapshot into an index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("snapshot_dir")
+    export_parser.add_argument("--index-name", default=None, help="defaults to INDEX_NAME")
+    export_parser.add_argument("--float16", action="store_true", help="store vectors as float16 (half the size)")
+    restore_parser = subparsers.add_parser("restore")
+    restore_parser.add_argument("snapshot_dir")
+    restore_parser.add_argument("--index-name", default=None, help="defaults to INDEX_NAME")
+    restore_parser.add_argument("--batch-size", type=int, default=100)
+    restore_parser.add_argument("--workers", type=int, default=8)
+    restore_parser.add_argument("--create-index", action="store_true",
+                                help="create the target index with the current schema from initial_setup_aisearch first")
+    args = parser.parse_args()
+
+    load_azd_env()
+    index_name = args.index_name or os.getenv('INDEX_NAME', 'test-index')
+    if args.command == "export":
+        export_snapshot(index_name, args.snapshot_dir, os.getenv('AZURE_SEARCH_ENDPOINT'), os.getenv('AZURE_SEARCH_KEY'),
+                        vector_dtype="float16" if args.float16 else "float32")
+    else:
+        if args.create_index:
+            create_index(index_name, os.getenv('AZURE_SEARCH_ENDPOINT'), os.getenv('AZURE_SEARCH_KEY'),
+                         os.getenv('AZURE_OPENAI_ENDPOINT'), os.getenv('AZURE_OPENAI_KEY'), os.getenv('AZURE_OPENAI_EMBEDDING_MODEL'))
+        restore_snapshot(args.snapshot_dir, index_name, os.getenv('AZURE_SEARCH_ENDPOINT'), os.getenv('AZURE_SEARCH_KEY'),
+                         batch_size=args.batch_size, workers=args.workers)
@@ -6,7 +6,10 @@ import requests
 
 from common import check_nan,text_to_base64
 from load_azd_env import load_azd_env
+from tracing import span
 
+# Indexer enrichment cache and skill reset are only available in preview api-versions.
+PREVIEW_API_VERSION = '2024-05-01-preview'
 
 # create datasource
 
@@ -28,8 +31,11 @@ def create_datasource(datasource_name:str, connection_string:str, ai_search_endp
     params = {'api-version': '2024-07-01'}
 
 
-    r = requests.put(ai_search_endpoint + "/datasources/" + datasource_name,
-                    data=json.dumps(datasource_payload), headers=headers, params=params)
+    body = json.dumps(datasource_payload)
+    with span("search.put", resource_type="datasources", resource_name=datasource_name, payload_bytes=len(body)) as s:
+        r = requests.put(ai_search_endpoint + "/datasources/" + datasource_name,
+                        data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
     print("status code: ", r.status_code)
     # status check
     if 200 <= r.status_code < 300:
@@ -45,16 +51,18 @@ def create_index(index_name:str, ai_search_endpoint:str, ai_search_key:str, azur
     "fields": [
         {"name": "chunk_id", "type": "Edm.String", "key": "true", "searchable": "true", "analyzer": "keyword", "retrievable": "true", "sortable": "true", "filterable": "true","facetable": "true"},
         {"name": "parent_id", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "true", "filterable": "true","facetable": "true"},
-        {"name": "title", "type": "Edm.String", "searchable": "true", "analyzer": "ja.lucene","retrievable": "true", "facetable": "false", "filterable": "true", "sortable": "false"},
+        {"name": "title", "type": "Edm.String", "searchable": "true", "analyzer": "ja.lucene","retrievable": "true", "facetable": "true", "filterable": "true", "sortable": "false"},
         {"name": "chunk", "type": "Edm.String", "searchable": "true", "analyzer": "ja.lucene","retrievable": "true", "facetable": "false", "filterable": "false", "sortable": "false"},
-        {"name": "location", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
-        {"name": "language", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
+        {"name": "location", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "true", "facetable": "false"},
+        {"name": "language", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "true", "facetable": "true"},
+        {"name": "department", "type": "Edm.String", "searchable": "false", "retrievable": "true", "sortable": "false", "filterable": "true", "facetable": "true"},
+        {"name": "content_type", "type": "Edm.String", "searchable": "false", "retrievable": "true", "sortable": "false", "filterable": "true", "facetable": "true"},
         {"name": "persons", "type": "Collection(Edm.String)", "searchable": "true", "analyzer": "ja.lucene", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
         {"name": "urls", "type": "Collection(Edm.String)", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
         {"name": "emails", "type": "Collection(Edm.String)", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
         {"name": "key_phrases", "type": "Collection(Edm.String)", "searchable": "true", "analyzer": "ja.lucene", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
         {"name": "original_chunk", "type": "Edm.String", "searchable": "false", "retrievable": "true", "facetable": "false", "filterable": "false", "sortable": "false"},
-        {"name": "metadata_storage_path", "type": "Edm.String", "searchable": "false", "retrievable": "true", "facetable": "false", "filterable": "false", "sortable": "false"},
+        {"name": "metadata_storage_path", "type": "Edm.String", "searchable": "false", "retrievable": "true", "facetable": "false", "filterable": "true", "sortable": "false"},
         {"name": "vector","type": "Collection(Edm.Single)", "searchable": "true", "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false", "dimensions": 3072, "vectorSearchProfile": "vector-profile"},
     ],
     "semantic": {
@@ -117,8 +125,11 @@ def create_index(index_name:str, ai_search_endpoint:str, ai_search_key:str, azur
     headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
     params = {'api-version': '2024-07-01'}
 
-    r = requests.put(ai_search_endpoint + "/indexes/" + index_name,
-                    data=json.dumps(index_payload), headers=headers, params=params)
+    body = json.dumps(index_payload)
+    with span("search.put", resource_type="indexes", resource_name=index_name, payload_bytes=len(body)) as s:
+        r = requests.put(ai_search_endpoint + "/indexes/" + index_name,
+                        data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
     print("status_code:", r.status_code)
     # status check
     if 200 <= r.status_code < 300:
@@ -126,8 +137,8 @@ def create_index(index_name:str, ai_search_endpoint:str, ai_search_key:str, azur
     else:
         print("Error creating index")
 
-def create_skillset(skillset_name:str,index_name:str,ai_search_endpoint:str,ai_search_key:str, azure_openai_endpoint:str, azure_openai_key:str, text_embedding_model:str, aiservices_key:str):
-    skillset_payload = {
+def build_skillset_payload(skillset_name:str,index_name:str, azure_openai_endpoint:str, azure_openai_key:str, text_embedding_model:str, aiservices_key:str):
+    return {
     "name": skillset_name,
     "description": "Skillset to chunk documents and generate embeddings",
     "skills": [
@@ -642,6 +653,18 @@ def create_skillset(skillset_name:str,index_name:str,ai_search_endpoint:str,ai_s
               "source": "/document/metadata_storage_path",
               "sourceContext": None,
               "inputs": []
+            },
+            {
+              "name": "department",
+              "source": "/document/department",
+              "sourceContext": None,
+              "inputs": []
+            },
+            {
+              "name": "content_type",
+              "source": "/document/metadata_content_type",
+              "sourceContext": None,
+              "inputs": []
             }
           ]
         }
@@ -653,11 +676,26 @@ def create_skillset(skillset_name:str,index_name:str,ai_search_endpoint:str,ai_s
     "encryptionKey": None
 
 }
+
+def create_skillset(skillset_name:str,index_name:str,ai_search_endpoint:str,ai_search_key:str, azure_openai_endpoint:str, azure_openai_key:str, text_embedding_model:str, aiservices_key:str):
+    print("Creating skillset")
+
+    skillset_payload = build_skillset_payload(
+        skillset_name=skillset_name,
+        index_name=index_name,
+        azure_openai_endpoint=azure_openai_endpoint,
+        azure_openai_key=azure_openai_key,
+        text_embedding_model=text_embedding_model,
+        aiservices_key=aiservices_key
+    )
     headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
     params = {'api-version': '2024-07-01'}
 
-    r = requests.put(ai_search_endpoint + "/skillsets/" + skillset_name,
-                    data=json.dumps(skillset_payload), headers=headers, params=params)
+    body = json.dumps(skillset_payload)
+    with span("search.put", resource_type="skillsets", resource_name=skillset_name, payload_bytes=len(body)) as s:
+        r = requests.put(ai_search_endpoint + "/skillsets/" + skillset_name,
+                        data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
     print("status code: ", r.status_code)
     # status check
     if 200 <= r.status_code < 300:
@@ -665,7 +703,7 @@ def create_skillset(skillset_name:str,index_name:str,ai_search_endpoint:str,ai_s
     else:
         print("Error creating skillset")
 
-def create_indexer(indexer_name:str, datasource_name:str, skillset_name:str, index_name:str, ai_search_endpoint:str, ai_search_key:str):
+def create_indexer(indexer_name:str, datasource_name:str, skillset_name:str, index_name:str, ai_search_endpoint:str, ai_search_key:str, cache_connection_string:str = None):
     print("Creating indexer")
     
     indexer_payload = {
@@ -694,6 +732,15 @@ def create_indexer(indexer_name:str, datasource_name:str, skillset_name:str, ind
             "sourceFieldName": "metadata_storage_name",
             "targetFieldName": "title",
             "mappingFunction": None
+            },
+            # top-level folder under the container, set as blob metadata by sync_to_blob.sh/.ps1.
+            # Metadata values are ASCII only, so the folder name is stored URL-encoded; blobs at the root have none.
+            {
+            "sourceFieldName": "department",
+            "targetFieldName": "department",
+            "mappingFunction": {
+                "name": "urlDecode"
+                }
             }
         ],
         "outputFieldMappings": [],
@@ -703,8 +750,20 @@ def create_indexer(indexer_name:str, datasource_name:str, skillset_name:str, ind
     headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
     params = {'api-version': '2024-07-01'}
 
-    r = requests.put(ai_search_endpoint + "/indexers/" + indexer_name,
-                    data=json.dumps(indexer_payload), headers=headers, params=params)
+    # incremental enrichment: cached skill outputs are kept in the storage account,
+    # so editing one skill only re-runs that skill and the skills downstream of it
+    if cache_connection_string:
+        indexer_payload["cache"] = {
+            "storageConnectionString": cache_connection_string,
+            "enableReprocessing": True
+        }
+        params = {'api-version': PREVIEW_API_VERSION}
+
+    body = json.dumps(indexer_payload)
+    with span("search.put", resource_type="indexers", resource_name=indexer_name, payload_bytes=len(body)) as s:
+        r = requests.put(ai_search_endpoint + "/indexers/" + indexer_name,
+                        data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
     print("status code: ", r.status_code)
     # status check
     if 200 <= r.status_code < 300:
@@ -733,57 +792,64 @@ if __name__ == "__main__":
     IS_DOC_INDEX_SETUP = os.getenv('IS_DOC_INDEX_SETUP', "false")
     IS_INDEXER_SETUP = os.getenv('IS_INDEXER_SETUP', "false")
     IS_SKILLSET_SETUP = os.getenv('IS_SKILLSET_SETUP', "false")
+    IS_ENRICHMENT_CACHE_ENABLED = os.getenv('IS_ENRICHMENT_CACHE_ENABLED', "true")
+    ENRICHMENT_CACHE_CONNECTION_STRING = os.getenv('ENRICHMENT_CACHE_CONNECTION_STRING', BLOB_CONNECTION_STRING)
     
 
     # Call the create_datasource function with the environment variables
     if IS_DATASOURCE_SETUP == "false":
-        create_datasource(
-            datasource_name=DATASOURCE_NAME,
-            connection_string=BLOB_CONNECTION_STRING,
-            ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
-            ai_search_key=AZURE_SEARCH_KEY,
-            container_name=BLOB_CONTAINER_NAME
-        )
+        with span("setup.datasource", profile=True):
+            create_datasource(
+                datasource_name=DATASOURCE_NAME,
+                connection_string=BLOB_CONNECTION_STRING,
+                ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
+                ai_search_key=AZURE_SEARCH_KEY,
+                container_name=BLOB_CONTAINER_NAME
+            )
     else:
         print("Datasource already created. Skipping...")
 
     # call the create_index function with the environment variables
     if IS_DOC_INDEX_SETUP == "false":
-        create_index(
-            index_name=INDEX_NAME,
-            ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
-            ai_search_key=AZURE_SEARCH_KEY,
-            azure_openai_endpoint=AOAI_ENDPOINT,
-            azure_openai_key=AOAI_KEY,
-            text_embedding_model=TEXT_EMBEDDING_MODEL
-        )
+        with span("setup.index", profile=True):
+            create_index(
+                index_name=INDEX_NAME,
+                ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
+                ai_search_key=AZURE_SEARCH_KEY,
+                azure_openai_endpoint=AOAI_ENDPOINT,
+                azure_openai_key=AOAI_KEY,
+                text_embedding_model=TEXT_EMBEDDING_MODEL
+            )
     else:
         print("Doc Index already created. Skipping...")
 
     # call the create_skillset function with the environment variables
     if IS_SKILLSET_SETUP == "false":
-        create_skillset(
-            skillset_name=SKILL_SET_NAME,
-            index_name=INDEX_NAME,
-            ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
-            ai_search_key=AZURE_SEARCH_KEY,
-            azure_openai_endpoint=AOAI_ENDPOINT,
-            azure_openai_key=AOAI_KEY,
-            text_embedding_model=TEXT_EMBEDDING_MODEL,
-            aiservices_key=AZURE_AISERVICES_KEY
-        )
+        with span("setup.skillset", profile=True):
+            create_skillset(
+                skillset_name=SKILL_SET_NAME,
+                index_name=INDEX_NAME,
+                ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
+                ai_search_key=AZURE_SEARCH_KEY,
+                azure_openai_endpoint=AOAI_ENDPOINT,
+                azure_openai_key=AOAI_KEY,
+                text_embedding_model=TEXT_EMBEDDING_MODEL,
+                aiservices_key=AZURE_AISERVICES_KEY
+            )
     else:
         print("Skillset already created. Skipping...")
 
     # call the create_indexer function with the environment variables
     if IS_INDEXER_SETUP == "false":
-        create_indexer(
-            indexer_name=INDEXER_NAME,
-            datasource_name=DATASOURCE_NAME,
-            skillset_name=SKILL_SET_NAME,
-            index_name=INDEX_NAME,
-            ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
-            ai_search_key=AZURE_SEARCH_KEY
-        )
+        with span("setup.indexer", profile=True):
+            create_indexer(
+                indexer_name=INDEXER_NAME,
+                datasource_name=DATASOURCE_NAME,
+                skillset_name=SKILL_SET_NAME,
+                index_name=INDEX_NAME,
+                ai_search_endpoint=AZURE_SEARCH_ENDPOINT,
+                ai_search_key=AZURE_SEARCH_KEY,
+                cache_connection_string=ENRICHMENT_CACHE_CONNECTION_STRING if IS_ENRICHMENT_CACHE_ENABLED == "true" else None
+            )
     else:
         print("Indexer already created. Skipping...")
\ No newline at end of file
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+import httpx
+
+from answer_service import AnswerService
+from tracing import span
+
+MODES = ("keyword", "vector", "hybrid", "semantic")
+THROTTLE_STATUS = (429, 503)
+SYNTHETIC_QUERIES = [
+    "TeamsとOutlookの使い分けを教えてください",
+    "社外の人とファイルを共有する方法",
+    "会議の録画はどこに保存されますか",
+    "チャットとメールのどちらを使うべきか",
+    "チャネルの作成手順",
+    "Outlookで予定表を共有するには",
+    "外部ゲストをチームに招待する方法",
+    "メンションの使い方",
+    "ファイルの共同編集について",
+    "通知の設定を変更したい",
+]
+
+
+def load_queries(path:str = None):
+    """Queries from a log file (plain text or JSON lines with a "query"/"search" field), else synthetic ones."""
+    if not path:
+        return list(SYNTHETIC_QUERIES)
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                line = entry.get("query") or entry.get("search") or ""
+            if line:
+                queries.append(line)
+    return queries
+
+
+async def run_query(service:AnswerService, mode:str, query:str):
+    """One query through the same calls answer_service uses, query embedding included."""
+    if mode == "keyword":
+        return await service.keyword_search(query)
+    if mode == "hybrid":
+        # what stream_answer retrieves with: keyword and vector legs fused on the client
+        return await service.retrieve(query)
+    vector = await service.embed(query)
+    if mode == "vector":
+        return await service.vector_search(vector)
+    return await service.semantic_search(query, vector)
+
+
+def percentile(sorted_values:list, p:float):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.throttled = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def summary(self, slo_ms:float = None):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        latencies = sorted(self.latencies)
+        total = len(latencies) + self.errors + self.throttled
+        report = {
+            "requests": total,
+            "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "error_rate": self.errors / total if total else 0.0,
+            "throttle_rate": self.throttled / total if total else 0.0,
+        }
+        if slo_ms is not None:
+            report["meets_slo"] = report["p95_ms"] is not None and report["p95_ms"] <= slo_ms
+        return report
+
+
+async def send_query(service:AnswerService, mode:str, query:str, recorder:Recorder):
+    started = time.perf_counter()
+    with span("loadtest.query", mode=mode) as s:
+        try:
+            await run_query(service, mode, query)
+            status = 200
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+        except httpx.HTTPError as e:
+            status = None
+            s.set_attribute("error", type(e).__name__)
+        s.set_attribute("status", status)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if status is not None and 200 <= status < 300:
+        recorder.latencies.append(elapsed_ms)
+    elif status in THROTTLE_STATUS:
+        recorder.throttled += 1
+    else:
+        recorder.errors += 1
+
+
+async def run_open_loop(service:AnswerService, mode:str, queries:list, rate:float, duration:float):
+    """Poisson arrivals at `rate` requests/sec, independent of how fast responses come back."""
+    recorder = Recorder()
+    cycle = itertools.cycle(queries)
+    tasks = []
+    deadline = time.perf_counter() + duration
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send_query(service, mode, next(cycle), recorder)))
+        next_at += random.expovariate(rate)
+    await asyncio.gather(*tasks)
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def run_closed_loop(service:AnswerService, mode:str, queries:list, concurrency:int, duration:float):
+    """`concurrency` workers each sending the next query as soon as the previous one returns."""
+    recorder = Recorder()
+    cycle = itertools.cycle(queries)
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await send_query(service, mode, next(cycle), recorder)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def run_load_test(search_endpoint:str, search_key:str, index_name:str, openai_endpoint:str, openai_key:str, queries:list,
+                        modes:list = MODES, ramp:list = None, rate:float = None, duration:float = 30.0, slo_ms:float = None,
+                        max_connections:int = 256):
+    """Run every mode either at an open-loop arrival `rate` or through each concurrency level in `ramp`."""
+    results = []
+    async with AnswerService(
+        search_endpoint=search_endpoint, search_key=search_key, index_name=index_name,
+        openai_endpoint=openai_endpoint, openai_key=openai_key,
+        max_search_concurrency=max_connections, max_openai_concurrency=max_connections,
+    ) as service:
+        for mode in modes:
+            if rate:
+                steps = [("rate", rate)]
+            else:
+                steps = [("concurrency", level) for level in (ramp or [1, 2, 4, 8, 16])]
+            for kind, level in steps:
+                with span("loadtest.step", mode=mode, **{kind: level}):
+                    if kind == "rate":
+                        recorder = await run_open_loop(service, mode, queries, level, duration)
+                    else:
+                        recorder = await run_closed_loop(service, mode, queries, level, duration)
+                result = {"mode": mode, kind: level, **recorder.summary(slo_ms)}
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_result(result:dict):
+    level = f"rate={result['rate']}/s" if "rate" in result else f"concurrency={result['concurrency']}"
+    latency = "/".join("-" if result[key] is None else f"{result[key]:.0f}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+    slo = ""
+    if "meets_slo" in result:
+        slo = " SLO ok" if result["meets_slo"] else " SLO MISSED"
+    print(f"{result['mode']:<9} {level:<16} {result['throughput_rps']:8.1f} rps  p50/p95/p99 {latency} ms  "
+          f"errors {result['error_rate']:.1%}  throttled {result['throttle_rate']:.1%}{slo}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the search query path")
+    parser.add_argument("--queries", help="query log (text or JSON lines); synthetic Japanese queries when omitted")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated subset of " + ",".join(MODES))
+    parser.add_argument("--ramp", default="1,2,4,8,16", help="closed-loop concurrency levels")
+    parser.add_argument("--rate", type=float, help="open-loop arrival rate (requests/sec) instead of a ramp")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per step")
+    parser.add_argument("--slo-ms", type=float, help="p95 latency objective")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--stub", action="store_true", help="run against a local stub server instead of Azure")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_servers import start_stub_server
+        server, url = start_stub_server(latency=0.02)
+        os.environ.update({'AZURE_SEARCH_ENDPOINT': url, 'AZURE_SEARCH_KEY': 'stub',
+                           'AZURE_OPENAI_ENDPOINT': url, 'AZURE_OPENAI_KEY': 'stub'})
+    else:
+        from load_azd_env import load_azd_env
+        load_azd_env()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+
+    results = asyncio.run(run_load_test(
+        search_endpoint=os.getenv('AZURE_SEARCH_ENDPOINT'),
+        search_key=os.getenv('AZURE_SEARCH_KEY'),
+        index_name=os.getenv('INDEX_NAME', 'test-index'),
+        openai_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+        openai_key=os.getenv('AZURE_OPENAI_KEY'),
+        queries=load_queries(args.queries),
+        modes=modes,
+        ramp=[int(level) for level in args.ramp.split(",")],
+        rate=args.rate,
+        duration=args.duration,
+        slo_ms=args.slo_ms
+    ))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the Azure AI Search and Azure OpenAI REST endpoints used by
+# the scripts in this folder, so they can be exercised end to end without Azure.
+
+SEARCH_PATH = re.compile(r"^/indexes/([^/]+)/docs/search$")
+INDEX_DOCS_PATH = re.compile(r"^/indexes/([^/]+)/docs/index$")
+EMBEDDINGS_PATH = re.compile(r"^/openai/deployments/([^/]+)/embeddings$")
+CHAT_PATH = re.compile(r"^/openai/deployments/([^/]+)/chat/completions$")
+
+SAMPLE_TEXT = "TeamsとOutlookの使い分けについて説明します。チャットはTeams、社外とのやり取りはOutlookを使います。"
+
+
+def fake_vector(text:str, dimensions:int = 3072):
+    """Deterministic unit vector derived from the text, so identical queries embed identically."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.uniform(-1, 1) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+def fake_documents(top:int, seed:str, with_vectors:bool = False):
+    rng = random.Random(seed)
+    documents = []
+    for i in range(top):
+        parent = rng.randrange(max(1, top // 3))
+        page = rng.randrange(5)
+        document = {
+            "@search.score": round(1.0 / (i + 1), 4),
+            "chunk_id": f"stub{parent}_{page}_pages_{page}",
+            "parent_id": f"parent{parent}",
+            "title": f"sample{parent}.pdf",
+            "chunk": SAMPLE_TEXT * 5,
+            "language": "ja",
+        }
+        if with_vectors:
+            document["vector"] = fake_vector(document["chunk_id"], 8)
+        documents.append(document)
+    return documents
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # overridden per server in start_stub_server
+    latency = 0.0
+    token_delay = 0.0
+    answer_tokens = 20
+    throttle_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status:int, payload:dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?", 1)[0]
+        time.sleep(self.latency)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            self._send_json(429, {"error": {"code": "Throttled", "message": "stub throttling"}})
+            return
+
+        if SEARCH_PATH.match(path):
+            top = int(request.get("top", 10))
+            seed = json.dumps(request, sort_keys=True, ensure_ascii=False)
+            self._send_json(200, {"value": fake_documents(top, seed, "vector" in request.get("select", ""))})
+        elif INDEX_DOCS_PATH.match(path):
+            results = [{"key": document.get("chunk_id"), "status": True, "errorMessage": None, "statusCode": 201}
+                       for document in request.get("value", [])]
+            self._send_json(200, {"value": results})
+        elif EMBEDDINGS_PATH.match(path):
+            inputs = request.get("input", "")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            data = [{"object": "embedding", "index": i, "embedding": fake_vector(text, request.get("dimensions", 3072))}
+                    for i, text in enumerate(inputs)]
+            self._send_json(200, {"object": "list", "data": data})
+        elif CHAT_PATH.match(path):
+            self._stream_chat(request)
+        else:
+            self._send_json(404, {"error": {"code": "NotFound", "message": path}})
+
+    def _stream_chat(self, request:dict):
+        if not request.get("stream"):
+            content = "回答" * self.answer_tokens
+            self._send_json(200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(self.answer_tokens):
+                time.sleep(self.token_delay)
+                self._write_chunk({"choices": [{"index": 0, "delta": {"content": "回答"}}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                # like Azure OpenAI: one extra event with no choices; counts two tokens per delta so chunks != tokens
+                self._write_chunk({"choices": [], "usage": {"prompt_tokens": 0, "completion_tokens": self.answer_tokens * 2,
+                                                            "total_tokens": self.answer_tokens * 2}})
+            self._write_chunk("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading the stream
+            self.close_connection = True
+
+    def _write_chunk(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        event = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(port:int = 0, latency:float = 0.0, token_delay:float = 0.0, answer_tokens:int = 20, throttle_rate:float = 0.0):
+    """Start the stub in a background thread and return (server, base_url). Stop it with server.shutdown()."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "latency": latency,
+        "token_delay": token_delay,
+        "answer_tokens": answer_tokens,
+        "throttle_rate": throttle_rate,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for Azure AI Search and Azure OpenAI")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=20)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server, url = start_stub_server(args.port, args.latency, args.token_delay, args.answer_tokens, args.throttle_rate)
+    print(f"Stub server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -24,7 +24,17 @@ $LOCAL_DIRECTORY = "./data/docs"
 
 Write-Host 'uploading files to Azure Blob Storage'
 
-# Sync the local directory to the Azure Blob Storage container
-az storage blob upload-batch -d $CONTAINER_NAME --account-name $STORAGE_ACCOUNT_NAME --account-key $STORAGE_ACCOUNT_KEY --source $LOCAL_DIRECTORY --overwrite
+# Sync the local directory to the Azure Blob Storage container.
+# Each top-level folder is uploaded with its name as the "department" blob metadata (URL-encoded,
+# metadata values must be ASCII), which the indexer maps to the department field.
+# Files directly under the local directory get no department.
+foreach ($entry in Get-ChildItem -Path $LOCAL_DIRECTORY) {
+    if ($entry.PSIsContainer) {
+        $DEPARTMENT = [uri]::EscapeDataString($entry.Name)
+        az storage blob upload-batch -d $CONTAINER_NAME --account-name $STORAGE_ACCOUNT_NAME --account-key $STORAGE_ACCOUNT_KEY --source $entry.FullName --destination-path $entry.Name --metadata "department=$DEPARTMENT" --overwrite
+    } else {
+        az storage blob upload -c $CONTAINER_NAME --account-name $STORAGE_ACCOUNT_NAME --account-key $STORAGE_ACCOUNT_KEY --file $entry.FullName --name $entry.Name --overwrite
+    }
+}
 
 Write-Host 'files uploaded to Azure Blob Storage'
\ No newline at end of file
@@ -17,7 +17,18 @@ LOCAL_DIRECTORY="./data/docs"
 
 echo 'uploading files to Azure Blob Storage'
 
-# Sync the local directory to the Azure Blob Storage container
-az storage blob upload-batch -d $CONTAINER_NAME --account-name $STORAGE_ACCOUNT_NAME --account-key $STORAGE_ACCOUNT_KEY --source $LOCAL_DIRECTORY --overwrite
+# Sync the local directory to the Azure Blob Storage container.
+# Each top-level folder is uploaded with its name as the "department" blob metadata (URL-encoded,
+# metadata values must be ASCII), which the indexer maps to the department field.
+# Files directly under the local directory get no department.
+for ENTRY in "$LOCAL_DIRECTORY"/*; do
+    NAME=$(basename "$ENTRY")
+    if [ -d "$ENTRY" ]; then
+        DEPARTMENT=$(python3 -c 'import sys, urllib.parse; print(urllib.parse.quote(sys.argv[1], safe=""))' "$NAME")
+        az storage blob upload-batch -d $CONTAINER_NAME --account-name $STORAGE_ACCOUNT_NAME --account-key $STORAGE_ACCOUNT_KEY --source "$ENTRY" --destination-path "$NAME" --metadata "department=$DEPARTMENT" --overwrite
+    elif [ -f "$ENTRY" ]; then
+        az storage blob upload -c $CONTAINER_NAME --account-name $STORAGE_ACCOUNT_NAME --account-key $STORAGE_ACCOUNT_KEY --file "$ENTRY" --name "$NAME" --overwrite
+    fi
+done
 
 echo 'files uploaded to Azure Blob Storage'
\ No newline at end of file
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+
+import openpyxl
+import pandas as pd
+import requests
+from openai import AzureOpenAI
+
+from common import normalize_nan, path_facets, text_to_base64
+from load_azd_env import load_azd_env
+from tracing import span
+
+# Loads Excel/CSV rows straight into the index created by initial_setup_aisearch.create_index.
+# Rows are read in fixed-size batches (openpyxl read-only mode / pandas chunked CSV reader)
+# and each batch is embedded and uploaded before the next one is read, so memory use
+# depends on the batch size and not on the size of the file.
+
+# sync_to_blob uploads this folder to the container root
+DOCS_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data", "docs")
+
+
+def source_key(path:str):
+    """Stable identifier for a file however it was typed: relative to DOCS_ROOT when under it, else absolute."""
+    path = os.path.realpath(path)
+    if os.path.commonpath([path, DOCS_ROOT]) == DOCS_ROOT:
+        path = os.path.relpath(path, DOCS_ROOT)
+    return path.replace(os.sep, "/")
+
+
+def unique_columns(header:tuple):
+    """Header names made unique the way pd.read_csv does it: 値, 値.1, 値.2 ..."""
+    columns = []
+    seen = set()
+    for i, name in enumerate(header):
+        name = str(name) if name is not None else f"column{i + 1}"
+        candidate, suffix = name, 0
+        while candidate in seen:
+            suffix += 1
+            candidate = f"{name}.{suffix}"
+        seen.add(candidate)
+        columns.append(candidate)
+    return columns
+
+
+def iter_excel_batches(path:str, batch_size:int):
+    """Yield (sheet_name, first_row_number, DataFrame) for every batch of rows in every sheet."""
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = unique_columns(header)
+            # object dtype keeps cells as openpyxl returned them, so integer IDs in columns
+            # with blanks are not coerced to float (12345 -> 12345.0)
+            batch = []
+            # row 1 is the header
+            first_row = 2
+            for row in rows:
+                batch.append(tuple(row[:len(columns)]) + (None,) * (len(columns) - len(row)))
+                if len(batch) == batch_size:
+                    yield sheet.title, first_row, pd.DataFrame(batch, columns=columns, dtype=object)
+                    first_row += len(batch)
+                    batch = []
+            if batch:
+                yield sheet.title, first_row, pd.DataFrame(batch, columns=columns, dtype=object)
+    finally:
+        workbook.close()
+
+
+def iter_csv_batches(path:str, batch_size:int, encoding:str = "utf-8-sig"):
+    first_row = 2
+    # keep_default_na=False keeps cells such as "NA", "N/A", "null" or "None" as text, like the Excel path;
+    # normalize_nan then blanks "nan" the same way check_nan does
+    for frame in pd.read_csv(path, chunksize=batch_size, dtype=str, encoding=encoding, keep_default_na=False):
+        yield None, first_row, frame
+        first_row += len(frame)
+
+
+def build_documents(frame, source_path:str, sheet:str, first_row:int, language:str = "ja"):
+    """Turn a batch of rows into chunk documents matching the index schema, one chunk per row."""
+    frame = normalize_nan(frame)
+    # "column: value" lines, skipping empty cells, built column-wise for the whole batch
+    lines = [(str(column) + ": " + frame[column]).where(frame[column] != "", "") for column in frame.columns]
+    texts = pd.concat(lines, axis=1).agg("\n".join, axis=1).str.replace(r"\n{2,}", "\n", regex=True).str.strip("\n")
+
+    title = os.path.basename(source_path) + (f" ({sheet})" if sheet else "")
+    department, content_type = path_facets(source_path, DOCS_ROOT)
+    source = source_key(source_path)
+    parent_id = text_to_base64(f"{source}#{sheet or ''}", url_safe=True)
+    documents = []
+    for offset, text in enumerate(texts):
+        if not text:
+            continue
+        documents.append({
+            "chunk_id": text_to_base64(f"{source}#{sheet or ''}#{first_row + offset}", url_safe=True),
+            "parent_id": parent_id,
+            "title": title,
+            "chunk": text,
+            "original_chunk": text,
+            "location": source,
+            "language": language,
+            "metadata_storage_path": source,
+            "department": department,
+            "content_type": content_type,
+        })
+    return documents
+
+
+def embed_documents(client:AzureOpenAI, documents:list, deployment:str = 'embedding'):
+    if not documents:
+        return
+    with span("tabular.embed", documents=len(documents)):
+        response = client.embeddings.create(input=[document["chunk"] for document in documents], model=deployment, dimensions=3072)
+    for document, item in zip(documents, response.data):
+        document["vector"] = item.embedding
+
+
+def upload_documents(documents:list, index_name:str, ai_search_endpoint:str, ai_search_key:str, session:requests.Session = None):
+    headers = {'Content-Type': 'application/json', 'api-key': ai_search_key}
+    params = {'api-version': '2024-07-01'}
+    body = json.dumps({"value": [{"@search.action": "mergeOrUpload", **document} for document in documents]})
+    with span("search.post", resource_type="docs", resource_name=index_name, payload_bytes=len(body), documents=len(documents)) as s:
+        r = (session or requests).post(ai_search_endpoint + "/indexes/" + index_name + "/docs/index",
+                                       data=body, headers=headers, params=params)
+        s.set_attribute("status", r.status_code)
+    if not 200 <= r.status_code < 300:
+        print("Error uploading documents. status code: ", r.status_code)
+        return 0
+    return sum(1 for result in r.json()["value"] if result.get("status"))
+
+
+def load_table(path:str, index_name:str, ai_search_endpoint:str, ai_search_key:str, openai_client:AzureOpenAI = None,
+               batch_size:int = 100, encoding:str = "utf-8-sig"):
+    print(f"Loading {path}")
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        batches = iter_excel_batches(path, batch_size)
+    else:
+        batches = iter_csv_batches(path, batch_size, encoding)
+
+    uploaded = 0
+    with requests.Session() as session:
+        for sheet, first_row, frame in batches:
+            with span("tabular.batch", source=path, sheet=sheet, first_row=first_row, rows=len(frame)):
+                documents = build_documents(frame, path, sheet, first_row)
+                if openai_client is not None:
+                    embed_documents(openai_client, documents)
+                if documents:
+                    uploaded += upload_documents(documents, index_name, ai_search_endpoint, ai_search_key, session)
+    print(f"Uploaded {uploaded} documents")
+    return uploaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream Excel/CSV rows into the search index")
+    parser.add_argument("paths", nargs="+", help=".xlsx or .csv files")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--encoding", default="utf-8-sig", help="CSV encoding (e.g. cp932)")
+    parser.add_argument("--no-embedding", action="store_true", help="upload without vectors")
+    args = parser.parse_args()
+
+    load_azd_env()
+
+    openai_client = None
+    if not args.no_embedding:
+        openai_client = AzureOpenAI(
+            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+            api_key=os.getenv('AZURE_OPENAI_KEY'),
+            api_version='2024-06-01'
+        )
+    for path in args.paths:
+        load_table(
+            path,
+            index_name=os.getenv('INDEX_NAME', 'test-index'),
+            ai_search_endpoint=os.getenv('AZURE_SEARCH_ENDPOINT'),
+            ai_search_key=os.getenv('AZURE_SEARCH_KEY'),
+            openai_client=openai_client,
+            batch_size=args.batch_size,
+            encoding=args.encoding
+        )
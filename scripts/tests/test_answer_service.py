@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+
+import tracing
+from answer_service import AnswerService
+from stub_servers import start_stub_server
+
+
+@pytest.fixture
+def stub_url():
+    server, url = start_stub_server(token_delay=0.001, answer_tokens=5)
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    monkeypatch.delenv("TRACE_OUTPUT", raising=False)
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(output=str(path))
+    yield path
+    tracing.configure()
+
+
+def _service(url:str):
+    return AnswerService(search_endpoint=url, search_key="stub", index_name="test-index", openai_endpoint=url, openai_key="stub")
+
+
+def test_answer_against_stub(stub_url):
+    async def main():
+        async with _service(stub_url) as service:
+            return await service.answer("TeamsとOutlookの使い分けを教えてください")
+
+    result = asyncio.run(main())
+    assert result["answer"] == "回答" * 5
+    assert result["metrics"]["time_to_first_token_ms"] > 0
+    # the stub reports two tokens per streamed delta in its usage event
+    assert result["metrics"]["completion_tokens"] == 10
+    assert result["metrics"]["completion_chunks"] == 5
+
+
+def test_stream_closed_early_with_tracing(stub_url, trace_file):
+    errors = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        async with _service(stub_url) as service:
+            async for _ in service.stream_answer("チャネルの作成手順"):
+                break
+            with tracing.span("caller"):
+                pass
+            # let the event loop finalize the abandoned generator
+            for _ in range(10):
+                await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert errors == []
+    spans = {record["name"]: record for record in map(json.loads, trace_file.read_text(encoding="utf-8").splitlines())}
+    assert "openai.chat" in spans
+    assert spans["caller"]["parent_id"] is None
@@ -0,0 +1,270 @@
+import atexit
+import cProfile
+import collections
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Tracing is configured through environment variables so it can be switched on
+# for a single azd run without touching the scripts.
+#   TRACE_OUTPUT  : file to append spans to. Tracing is disabled when unset.
+#   TRACE_FORMAT  : "jsonl" (default) or "otlp" (OTLP/JSON, one export request per line)
+#   TRACE_PROFILE : "cprofile" or "sampling" to profile spans opened with profile=True
+#   TRACE_SAMPLING_INTERVAL : seconds between stack samples (default 0.005)
+
+SERVICE_NAME = "azd-rag-scripts"
+
+# Context variables follow both threads and asyncio tasks, so concurrent spans nest correctly.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled so instrumented code costs almost nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def start(self):
+        return self
+
+    def end(self, exc=None):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval and counts collapsed stacks."""
+
+    def __init__(self, interval:float):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class Span:
+    def __init__(self, tracer, name:str, attributes:dict, profile:bool):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.profile = profile
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error = None
+        self._profiler = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    def start(self):
+        """Start the span without making it the current one.
+
+        For work that spans a `yield` (e.g. a streamed response): the generator can be resumed or
+        closed from another task, where a context variable set here could not be reset.
+        """
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        if self.profile:
+            self._profiler = self.tracer._start_profiler()
+        self.start_ns = time.time_ns()
+        return self
+
+    def end(self, exc=None):
+        self.end_ns = time.time_ns()
+        if self._profiler is not None:
+            self.tracer._stop_profiler(self, self._profiler)
+        if exc is not None:
+            self.error = f"{type(exc).__name__}: {exc}"
+        self.tracer._export(self)
+
+    def __enter__(self):
+        self.start()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+
+class Tracer:
+    def __init__(self, output:str, fmt:str = "jsonl", profile_mode:str = "", sampling_interval:float = 0.005):
+        if fmt not in ("jsonl", "otlp"):
+            raise ValueError(f"Unsupported trace format: {fmt}")
+        if profile_mode not in ("", "cprofile", "sampling"):
+            raise ValueError(f"Unsupported profile mode: {profile_mode}")
+        self.output = output
+        self.format = fmt
+        self.profile_mode = profile_mode
+        self.sampling_interval = sampling_interval
+        self.trace_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._file = open(output, "a", encoding="utf-8")
+        self._cprofile_active = False
+        atexit.register(self.close)
+
+    def span(self, name:str, profile:bool = False, **attributes):
+        return Span(self, name, attributes, profile and bool(self.profile_mode))
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _start_profiler(self):
+        if self.profile_mode == "sampling":
+            profiler = _SamplingProfiler(self.sampling_interval)
+            profiler.start()
+            return profiler
+        # Only one cProfile can be active per process, nested or concurrent spans are not profiled.
+        with self._lock:
+            if self._cprofile_active:
+                return None
+            self._cprofile_active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, span:Span, profiler):
+        base = f"{self.output}.{span.span_id}.{span.name.replace('/', '_')}"
+        if isinstance(profiler, _SamplingProfiler):
+            profiler.stop()
+            path = base + ".folded"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in profiler.counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            span.set_attribute("profile.samples", sum(profiler.counts.values()))
+        else:
+            profiler.disable()
+            path = base + ".prof"
+            profiler.dump_stats(path)
+            with self._lock:
+                self._cprofile_active = False
+        span.set_attribute("profile.file", path)
+
+    def _export(self, span:Span):
+        if self.format == "otlp":
+            record = self._to_otlp(span)
+        else:
+            record = {
+                "trace_id": self.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "start_ns": span.start_ns,
+                "duration_ms": (span.end_ns - span.start_ns) / 1e6,
+                "attributes": span.attributes,
+                "error": span.error,
+            }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def _to_otlp(self, span:Span):
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [otlp_span]}],
+            }]
+        }
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+_tracer = None
+
+
+def configure(output:str = None, fmt:str = None, profile_mode:str = None):
+    """Enable tracing explicitly, or from TRACE_* environment variables when arguments are omitted."""
+    global _tracer
+    output = output or os.getenv("TRACE_OUTPUT")
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+    if not output:
+        return None
+    _tracer = Tracer(
+        output,
+        fmt=fmt or os.getenv("TRACE_FORMAT", "jsonl"),
+        profile_mode=(profile_mode if profile_mode is not None else os.getenv("TRACE_PROFILE", "")).lower(),
+        sampling_interval=float(os.getenv("TRACE_SAMPLING_INTERVAL", "0.005")),
+    )
+    return _tracer
+
+
+def span(name:str, profile:bool = False, **attributes):
+    """Open a span, e.g. `with span("search.put", resource=name) as s: s.set_attribute("status", 201)`.
+
+    Use `s = span(...).start()` and `s.end()` instead of `with` when the span stays open across a `yield`.
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _tracer.span(name, profile=profile, **attributes)
+
+
+configure()